@@ -1,14 +1,18 @@
 import os
 import uuid
-import tempfile
+import hashlib
+import threading
 from pathlib import Path
 import traceback
-from flask import Flask, jsonify, request
+import orjson
+from cachetools import TTLCache
+from flask import Flask, Response, request, stream_with_context
+from werkzeug.exceptions import BadRequest
 from flask_cors import CORS
 from dotenv import load_dotenv
-from embedder import GeminiEmbedder
-from document_processor import extract_text, chunk_text
-from chroma_client import ChromaClient
+from embedder import GeminiEmbedder, GEMINI_SESSION
+from document_processor import extract_text, chunk_spans
+from chroma_client import ChromaClient, format_results, mmr_rerank
 
 # ----------------------------
 # Load environment variables
@@ -18,6 +22,19 @@ load_dotenv()
 PORT = int(os.getenv("PORT", 5001))
 COLLECTION_NAME = "rag_documents"  # ✅ Updated collection name
 
+# Generated answers keyed on (docs version, query hash, chunk ids). The TTL
+# bounds staleness; the version is bumped whenever the document set changes.
+ANSWER_CACHE = TTLCache(maxsize=512, ttl=300)
+ANSWER_CACHE_LOCK = threading.Lock()
+DOCS_VERSION = 0
+
+# Characters of each chunk kept as its metadata preview
+PREVIEW_CHARS = 150
+
+# /api/answer over-fetches this many candidates per requested chunk and
+# keeps a diverse top_k of them via MMR.
+MMR_FETCH_FACTOR = 3
+
 # ----------------------------
 # Flask Setup
 # ----------------------------
@@ -25,6 +42,26 @@ FRONTEND_DIR = Path(__file__).resolve().parent.parent / "frontend"
 app = Flask(__name__, static_folder=str(FRONTEND_DIR), static_url_path="")
 CORS(app)
 
+def json_response(obj):
+    """orjson-backed replacement for flask.jsonify (numpy values allowed)."""
+    return app.response_class(
+        orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+        mimetype="application/json",
+    )
+
+
+def request_json():
+    """Parse the request body with orjson; an empty body yields {}."""
+    body = request.get_data()
+    if not body:
+        return {}
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise BadRequest("Request body is not valid JSON")
+    return data or {}
+
+
 @app.route("/")
 def index():
     return app.send_static_file("index.html")
@@ -58,16 +95,23 @@ except Exception as e:
     ERROR_MSG = str(e)
     print(f"[ERROR] Initialization failed: {ERROR_MSG}")
 
+def _bump_docs_version():
+    """Invalidate cached answers after the document set changes."""
+    global DOCS_VERSION
+    with ANSWER_CACHE_LOCK:
+        DOCS_VERSION += 1
+        ANSWER_CACHE.clear()
+
 # ----------------------------
 # Health Check
 # ----------------------------
 @app.route("/healthz", methods=["GET"])
 def healthz():
     if not CLIENTS_OK:
-        return jsonify({"status": "error", "details": ERROR_MSG}), 503
+        return json_response({"status": "error", "details": ERROR_MSG}), 503
 
     chroma_health = chroma.health_check()
-    return jsonify({
+    return json_response({
         "status": "ok",
         "gemini": True,
         "chroma": chroma_health["connected"],
@@ -82,46 +126,28 @@ def healthz():
 def upload():
     # Allow a browser GET to show a helpful message instead of 404
     if request.method == "GET":
-        return jsonify({"message": "Use POST to upload a file to this endpoint (multipart/form-data)."}), 200
+        return json_response({"message": "Use POST to upload a file to this endpoint (multipart/form-data)."}), 200
     if not CLIENTS_OK:
-        return jsonify({"error": ERROR_MSG}), 503
+        return json_response({"error": ERROR_MSG}), 503
 
     if "file" not in request.files:
-        return jsonify({"error": "No file uploaded"}), 400
+        return json_response({"error": "No file uploaded"}), 400
 
     file = request.files["file"]
 
     try:
-        # Write uploaded file to a temporary path in a Windows-safe way
-        # (NamedTemporaryFile can lock the file on Windows if left open).
+        # Hand the upload stream straight to the extractor; no temp file copy
         suffix = Path(file.filename).suffix or ""
-        fd, temp_path = tempfile.mkstemp(suffix=suffix)
-        try:
-            with os.fdopen(fd, "wb") as out:
-                # Read the uploaded file stream in chunks to avoid large memory use
-                chunk = file.stream.read(8192)
-                while chunk:
-                    out.write(chunk)
-                    chunk = file.stream.read(8192)
-        except Exception:
-            # Ensure temp file is removed on error
-            try:
-                os.unlink(temp_path)
-            except Exception:
-                pass
-            raise
-
-        text = extract_text(temp_path)
+        text = extract_text(file.stream, suffix)
         print(f"[DEBUG] Extracted text length: {len(text) if text is not None else 'None'}")
         if not text or not text.strip():
-            os.unlink(temp_path)
-            return jsonify({"error": "No text extracted from file"}), 400
+            return json_response({"error": "No text extracted from file"}), 400
 
-        chunks = chunk_text(text, chunk_size=500, overlap=50)
+        spans = chunk_spans(text, chunk_size=500, overlap=50)
+        chunks = [text[start:end] for start, end in spans]
         print(f"[DEBUG] Produced {len(chunks)} chunks")
         if not chunks:
-            os.unlink(temp_path)
-            return jsonify({"error": "No chunks produced from file"}), 400
+            return json_response({"error": "No chunks produced from file"}), 400
 
         embeddings = embedder.embed_texts(chunks)
         print(f"[DEBUG] Generated {len(embeddings)} embeddings")
@@ -131,16 +157,23 @@ def upload():
             for i in range(len(chunks))
         ]
 
+        # Character offsets let the frontend highlight each chunk's range;
+        # the preview is what the fallback answer (and UI) show per chunk
         metadata = [
-            {"source": file.filename, "chunk_index": i}
-            for i in range(len(chunks))
+            {
+                "source": file.filename,
+                "chunk_index": i,
+                "start": start,
+                "end": end,
+                "preview": _preview(chunk),
+            }
+            for i, ((start, end), chunk) in enumerate(zip(spans, chunks))
         ]
 
         chroma.upsert_chunks(chunk_ids, chunks, embeddings, metadata)
+        _bump_docs_version()
 
-        os.unlink(temp_path)
-
-        return jsonify({
+        return json_response({
             "status": "success",
             "upload_id": uuid.uuid4().hex[:8],
             "chunks": len(chunks),
@@ -151,50 +184,71 @@ def upload():
     except Exception as e:
         print(f"[ERROR] Upload handler exception: {e}")
         traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 
 # ----------------------------
 # Answer Generation Helper
 # ----------------------------
+GEMINI_ANSWER_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash"
+
+
+def _answer_cache_key(query_text, chunks_data):
+    query_hash = hashlib.blake2b(query_text.encode("utf-8"), digest_size=16).hexdigest()
+    chunk_ids = tuple(sorted(chunk["chunk_id"] for chunk in chunks_data))
+    with ANSWER_CACHE_LOCK:
+        return (DOCS_VERSION, query_hash, chunk_ids)
+
+
+def _answer_payload(query_text, chunks_data):
+    """Gemini request body asking for an answer grounded in the chunks."""
+    context = "\n".join([f"- {chunk['text']}" for chunk in chunks_data])
+    prompt = f"""Based on the following documents, answer the user's question clearly and concisely.
+
+Documents:
+{context}
+
+User Question: {query_text}
+
+Please provide a direct, helpful answer."""
+
+    return {
+        "contents": [{
+            "parts": [{"text": prompt}]
+        }]
+    }
+
+
 def generate_answer(query_text, chunks_data):
     """Use Gemini to synthesize an answer from relevant chunks."""
     if not chunks_data:
         return "No relevant documents found to answer your question."
-    
-    context = "\n".join([f"- {chunk['text']}" for chunk in chunks_data])
-    
+
+    cache_key = _answer_cache_key(query_text, chunks_data)
+    with ANSWER_CACHE_LOCK:
+        cached = ANSWER_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        import requests
         api_key = os.getenv("GOOGLE_API_KEY")
         if not api_key:
             return _fallback_answer(query_text, chunks_data)
-        
+
         # Try with gemini-2.0-flash (current model)
-        url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+        url = f"{GEMINI_ANSWER_URL}:generateContent"
         headers = {"Content-Type": "application/json"}
-        
-        prompt = f"""Based on the following documents, answer the user's question clearly and concisely.
-
-Documents:
-{context}
-
-User Question: {query_text}
+        payload = _answer_payload(query_text, chunks_data)
 
-Please provide a direct, helpful answer."""
-        
-        payload = {
-            "contents": [{
-                "parts": [{"text": prompt}]
-            }]
-        }
-        
-        resp = requests.post(f"{url}?key={api_key}", json=payload, headers=headers, timeout=10)
+        resp = GEMINI_SESSION.post(url, json=payload, headers=headers, params={"key": api_key}, timeout=10)
         resp.raise_for_status()
         
         data = resp.json()
         if "candidates" in data and data["candidates"]:
             answer_text = data["candidates"][0]["content"]["parts"][0]["text"]
+            # Only real model answers are cached; fallbacks retry next time
+            with ANSWER_CACHE_LOCK:
+                ANSWER_CACHE[cache_key] = answer_text
             return answer_text
         
         return _fallback_answer(query_text, chunks_data)
@@ -204,6 +258,79 @@ Please provide a direct, helpful answer."""
         return _fallback_answer(query_text, chunks_data)
 
 
+class AnswerStreamInterrupted(Exception):
+    """Gemini's stream broke after part of the answer was already yielded."""
+
+
+def generate_answer_stream(query_text, chunks_data):
+    """Like generate_answer, but yields the answer text piece by piece as
+    Gemini produces it (streamGenerateContent over SSE).
+
+    Raises AnswerStreamInterrupted if the stream fails midway; failures
+    before the first piece yield the fallback answer instead.
+    """
+    if not chunks_data:
+        yield "No relevant documents found to answer your question."
+        return
+
+    cache_key = _answer_cache_key(query_text, chunks_data)
+    with ANSWER_CACHE_LOCK:
+        cached = ANSWER_CACHE.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        yield _fallback_answer(query_text, chunks_data)
+        return
+
+    url = f"{GEMINI_ANSWER_URL}:streamGenerateContent"
+    headers = {"Content-Type": "application/json"}
+    payload = _answer_payload(query_text, chunks_data)
+    parts = []
+
+    try:
+        with GEMINI_SESSION.post(
+            url,
+            json=payload,
+            headers=headers,
+            params={"key": api_key, "alt": "sse"},
+            timeout=10,
+            stream=True,
+        ) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                event = orjson.loads(line[len(b"data:"):])
+                for candidate in event.get("candidates", [])[:1]:
+                    for part in candidate.get("content", {}).get("parts", []):
+                        text = part.get("text")
+                        if text:
+                            parts.append(text)
+                            yield text
+    except Exception as e:
+        if parts:
+            # Part of the answer is already out; the caller must report it
+            # as truncated rather than complete (and it is not cached)
+            print(f"[WARNING] Gemini stream interrupted: {e}")
+            raise AnswerStreamInterrupted(str(e)) from e
+        print(f"[WARNING] Gemini API failed: {e}, using fallback answer")
+
+    if not parts:
+        yield _fallback_answer(query_text, chunks_data)
+        return
+
+    with ANSWER_CACHE_LOCK:
+        ANSWER_CACHE[cache_key] = "".join(parts)
+
+
+def _preview(text):
+    """Short excerpt of a chunk, stored in its metadata at upload time."""
+    return text[:PREVIEW_CHARS] + ("..." if len(text) > PREVIEW_CHARS else "")
+
+
 def _fallback_answer(query_text, chunks_data):
     """Generate a simple fallback answer by extracting relevant text."""
     if not chunks_data:
@@ -214,9 +341,12 @@ def _fallback_answer(query_text, chunks_data):
     answer_parts = []
     
     for chunk in top_chunks:
-        text = chunk.get("text", "").strip()
-        if text:
-            answer_parts.append(text[:150] + ("..." if len(text) > 150 else ""))
+        preview = (chunk.get("metadata") or {}).get("preview")
+        if preview is None:
+            # Chunks uploaded before previews were stored
+            preview = _preview(chunk.get("text", "").strip())
+        if preview:
+            answer_parts.append(preview)
     
     if answer_parts:
         return "Based on the documents:\n\n" + "\n\n".join(answer_parts)
@@ -230,14 +360,14 @@ def _fallback_answer(query_text, chunks_data):
 @app.route("/api/query", methods=["POST"])
 def query():
     if not CLIENTS_OK:
-        return jsonify({"error": ERROR_MSG}), 503
+        return json_response({"error": ERROR_MSG}), 503
 
-    data = request.get_json() or {}
+    data = request_json()
     query_text = data.get("query")
     top_k = int(data.get("top_k", 5))
 
     if not query_text:
-        return jsonify({"error": "Query is required"}), 400
+        return json_response({"error": "Query is required"}), 400
 
     try:
         # Generate embedding for user query
@@ -246,79 +376,54 @@ def query():
         # Query Chroma collection
         results = chroma.query_similar(query_embedding, top_k=top_k)
 
-        # Extract result components
-        ids = results.get("ids", [])
-        docs = results.get("documents", [])
-        dists = results.get("distances", [])
-        metas = results.get("metadatas", [])
-
         # Format results for frontend
-        formatted_results = []
-        for i in range(len(ids)):
-            distance = dists[i] if i < len(dists) else None
-            similarity_score = (1 - distance) if distance is not None else None
-
-            formatted_results.append({
-                "rank": i + 1,
-                "text": docs[i] if i < len(docs) else "",
-                "chunk_id": ids[i],
-                "metadata": metas[i] if i < len(metas) else {},
-                "similarity_score": round(similarity_score, 4) if similarity_score is not None else None
-            })
+        formatted_results = format_results(results)
 
-        return jsonify({"results": formatted_results}), 200
+        return json_response({"results": formatted_results}), 200
 
     except Exception as e:
         print(f"[ERROR] Query exception: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 
 # ----------------------------
 # Answer Endpoint (Query + LLM synthesis)
 # ----------------------------
+def _answer_sources(query_text, top_k):
+    """Retrieve the chunks an answer is generated from."""
+    # Generate embedding for user query
+    query_embedding = embedder.embed_single(query_text)
+
+    # Query Chroma collection for extra candidates, then drop
+    # near-duplicates so the LLM context isn't spent on repeats
+    candidates = chroma.query_similar(
+        query_embedding, top_k=top_k * MMR_FETCH_FACTOR, include_embeddings=True
+    )
+    results = mmr_rerank(candidates, query_embedding, top_k)
+
+    # Format chunks for answer generation
+    return format_results(results)
+
+
 @app.route("/api/answer", methods=["POST"])
 def answer():
     if not CLIENTS_OK:
-        return jsonify({"error": ERROR_MSG}), 503
+        return json_response({"error": ERROR_MSG}), 503
 
-    data = request.get_json() or {}
+    data = request_json()
     query_text = data.get("query")
     top_k = int(data.get("top_k", 5))
 
     if not query_text:
-        return jsonify({"error": "Query is required"}), 400
+        return json_response({"error": "Query is required"}), 400
 
     try:
-        # Generate embedding for user query
-        query_embedding = embedder.embed_single(query_text)
-
-        # Query Chroma collection
-        results = chroma.query_similar(query_embedding, top_k=top_k)
-
-        # Extract result components
-        ids = results.get("ids", [])
-        docs = results.get("documents", [])
-        dists = results.get("distances", [])
-        metas = results.get("metadatas", [])
-
-        # Format chunks for answer generation
-        chunks = []
-        for i in range(len(ids)):
-            distance = dists[i] if i < len(dists) else None
-            similarity_score = (1 - distance) if distance is not None else None
-
-            chunks.append({
-                "rank": i + 1,
-                "text": docs[i] if i < len(docs) else "",
-                "chunk_id": ids[i],
-                "metadata": metas[i] if i < len(metas) else {},
-                "similarity_score": round(similarity_score, 4) if similarity_score is not None else None
-            })
+        chunks = _answer_sources(query_text, top_k)
 
         # Generate answer using synthesized response
         answer_text = generate_answer(query_text, chunks)
 
-        return jsonify({
+        return json_response({
             "answer": answer_text,
             "sources": chunks,
             "source_count": len(chunks)
@@ -327,7 +432,52 @@ def answer():
     except Exception as e:
         print(f"[ERROR] Answer exception: {e}")
         traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
+
+
+@app.route("/api/answer/stream", methods=["POST"])
+def answer_stream():
+    """Server-sent events version of /api/answer.
+
+    Emits one `sources` event with the retrieved chunks, `data` events with
+    pieces of the answer as Gemini generates them, then a `done` event, or
+    an `error` event (`truncated: true`) if the stream broke midway.
+    """
+    if not CLIENTS_OK:
+        return json_response({"error": ERROR_MSG}), 503
+
+    data = request_json()
+    query_text = data.get("query")
+    top_k = int(data.get("top_k", 5))
+
+    if not query_text:
+        return json_response({"error": "Query is required"}), 400
+
+    try:
+        chunks = _answer_sources(query_text, top_k)
+    except Exception as e:
+        print(f"[ERROR] Answer stream exception: {e}")
+        traceback.print_exc()
+        return json_response({"error": str(e)}), 500
+
+    def events():
+        sources = {"sources": chunks, "source_count": len(chunks)}
+        yield b"event: sources\ndata: " + orjson.dumps(sources, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n\n"
+        # Each piece is JSON-encoded so newlines in the answer can't break framing
+        try:
+            for text in generate_answer_stream(query_text, chunks):
+                yield b"data: " + orjson.dumps({"text": text}) + b"\n\n"
+        except AnswerStreamInterrupted as e:
+            # No `done`: the client must not mistake this for a full answer
+            yield b"event: error\ndata: " + orjson.dumps({"error": str(e), "truncated": True}) + b"\n\n"
+            return
+        yield b"event: done\ndata: {}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # ----------------------------
@@ -336,18 +486,19 @@ def answer():
 @app.route("/api/documents", methods=["GET"])
 def get_documents():
     if not CLIENTS_OK:
-        return jsonify({"error": ERROR_MSG}), 503
+        return json_response({"error": ERROR_MSG}), 503
 
     try:
         limit = request.args.get("limit", 100, type=int)
-        documents = chroma.get_all_documents(limit=limit)
-        return jsonify({
+        ids_only = request.args.get("ids_only", "").lower() in ("1", "true", "yes")
+        documents = chroma.get_all_documents(limit=limit, ids_only=ids_only)
+        return json_response({
             "status": "success",
             "documents": documents,
             "count": len(documents)
         }), 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 
 # ----------------------------
@@ -356,18 +507,18 @@ def get_documents():
 @app.route("/api/collection", methods=["POST"])
 def create_collection_endpoint():
     if not CLIENTS_OK:
-        return jsonify({"error": ERROR_MSG}), 503
+        return json_response({"error": ERROR_MSG}), 503
 
     try:
-        data = request.get_json() or {}
+        data = request_json()
         collection_name = data.get("name", COLLECTION_NAME)
         chroma.get_or_create_collection(collection_name)
-        return jsonify({
+        return json_response({
             "status": "success",
             "collection": collection_name
         }), 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 
 # ----------------------------
@@ -376,13 +527,14 @@ def create_collection_endpoint():
 @app.route("/api/reset", methods=["DELETE"])
 def reset():
     if not CLIENTS_OK:
-        return jsonify({"error": ERROR_MSG}), 503
+        return json_response({"error": ERROR_MSG}), 503
 
     try:
         chroma.reset_collection(COLLECTION_NAME)
-        return jsonify({"status": "success"}), 200
+        _bump_docs_version()
+        return json_response({"status": "success"}), 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 
 # ----------------------------
@@ -391,13 +543,15 @@ def reset():
 @app.route("/api/stats", methods=["GET"])
 def stats():
     if not CLIENTS_OK:
-        return jsonify({"error": ERROR_MSG}), 503
+        return json_response({"error": ERROR_MSG}), 503
     try:
         count = chroma.count_documents()
-        return jsonify({"total_chunks": count}), 200
+        return json_response({"total_chunks": count}), 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=PORT, debug=True)
+    # Development server only; threaded so one slow Gemini call does not
+    # block other requests. Production runs under gunicorn (see wsgi.py).
+    app.run(host="0.0.0.0", port=PORT, debug=True, threaded=True)
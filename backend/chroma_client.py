@@ -1,5 +1,100 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 import chromadb
+import numpy as np
+
+
+# Collections up to this size are mirrored in process and searched exactly
+# with a single matmul; larger ones go through Chroma's HNSW index. Every
+# process (each gunicorn worker) holds its own mirror: at 10k x 3072 float32
+# that is ~120 MB of embeddings per worker, plus the chunk texts/metadata.
+LOCAL_INDEX_MAX = 10_000
+# Chroma Cloud rejects GETs with a larger limit
+GET_BATCH_SIZE = 300
+# Pages fetched concurrently when counting without collection.count()
+COUNT_MAX_WORKERS = 8
+
+# Relevance vs. diversity trade-off for mmr_rerank (1.0 = pure relevance)
+MMR_LAMBDA = 0.5
+
+# HNSW tuning applied when a collection is created. A larger construction_ef
+# and M build a denser graph (slower inserts, roughly M * 8 bytes more RAM
+# and disk per vector) in exchange for better recall. search_ef is fixed
+# rather than tied to n_results, so top-k ordering stays stable across top_k
+# values. These only take effect for new collections: an existing collection
+# keeps the settings it was created with (check collection.configuration),
+# and changing them is a server-side change shared by every client.
+HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64,
+    "hnsw:M": 32,
+}
+
+
+def format_results(results: Dict[str, List]) -> List[Dict[str, Any]]:
+    """Flatten a query_similar() result into ranked rows for the API."""
+    formatted = []
+    for rank, (cid, doc, dist, meta) in enumerate(
+        zip(results["ids"], results["documents"], results["distances"], results["metadatas"]), 1
+    ):
+        formatted.append({
+            "rank": rank,
+            "text": doc or "",
+            "chunk_id": cid,
+            "metadata": meta or {},
+            # Unrounded; the frontend formats it for display
+            "similarity_score": 1.0 - dist if dist is not None else None,
+        })
+    return formatted
+
+
+def mmr_rerank(
+    results: Dict[str, Any],
+    query_embedding: np.ndarray,
+    top_k: int,
+    lambda_mult: float = MMR_LAMBDA,
+) -> Dict[str, List]:
+    """Pick top_k rows of a query_similar(include_embeddings=True) result by
+    maximal marginal relevance, so near-duplicate chunks are not all kept.
+
+    All pairwise similarities are computed once up front; each step is then
+    a vectorized argmax of lambda * sim(q) - (1 - lambda) * max sim(selected).
+    """
+    E = np.asarray(results["embeddings"], dtype=np.float32)
+    n = len(E)
+    if n == 0:
+        return {key: [] for key in ("ids", "documents", "distances", "metadatas")}
+
+    norms = np.linalg.norm(E, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    E = E / norms
+    q = np.asarray(query_embedding, dtype=np.float32)
+    q_norm = np.linalg.norm(q)
+    if q_norm > 0:
+        q = q / q_norm
+
+    sim_q = E @ q
+    sim = E @ E.T
+    first = int(np.argmax(sim_q))
+    selected = [first]
+    chosen = np.zeros(n, dtype=bool)
+    chosen[first] = True
+    max_sim_sel = sim[first].copy()
+    for _ in range(min(top_k, n) - 1):
+        scores = lambda_mult * sim_q - (1 - lambda_mult) * max_sim_sel
+        scores[chosen] = -np.inf
+        i = int(np.argmax(scores))
+        selected.append(i)
+        chosen[i] = True
+        np.maximum(max_sim_sel, sim[i], out=max_sim_sel)
+
+    return {
+        key: [results[key][i] for i in selected]
+        for key in ("ids", "documents", "distances", "metadatas")
+    }
 
 
 class ChromaClient:
@@ -13,49 +108,215 @@ class ChromaClient:
             self.collection = None
         except Exception as e:
             raise RuntimeError(f"ChromaDB connection error: {e}")
+        # The client is a module-level singleton shared by all request
+        # threads/greenlets; guards the local index.
+        self._lock = threading.RLock()
+        self._reset_local_index()
 
     def get_or_create_collection(self, collection_name: str):
         try:
             self.collection = self.client.get_or_create_collection(
                 name=collection_name,
-                metadata={"hnsw:space": "cosine"},
+                metadata=HNSW_METADATA,
             )
         except Exception as e:
             raise RuntimeError(f"Collection error: {e}")
+        with self._lock:
+            self._reset_local_index()
+
+    def _reset_local_index(self):
+        """Drop the in-process mirror of the collection (call with the lock held)."""
+        self._E = np.empty((0, 0), dtype=np.float32)  # L2-normalized rows
+        self._ids = []
+        self._docs = []
+        self._metas = []
+        self._pos = {}
+        self._index_loaded = False
+        # Bumped on every change, so a reload fetched without the lock can
+        # tell whether it raced with an upsert or reset
+        self._generation = getattr(self, "_generation", 0) + 1
+
+    @staticmethod
+    def _normalize(embeddings) -> np.ndarray:
+        E = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(E, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return E / norms
+
+    def _fetch_local_index(self):
+        """Page the whole collection in; pure network I/O, no shared state."""
+        ids, docs, metas, rows = [], [], [], []
+        offset = 0
+        while True:
+            results = self.collection.get(
+                limit=GET_BATCH_SIZE,
+                offset=offset,
+                include=["embeddings", "documents", "metadatas"],
+            )
+            page_ids = results.get("ids", [])
+            ids.extend(page_ids)
+            docs.extend(results["documents"])
+            metas.extend(results["metadatas"])
+            rows.extend(results["embeddings"])
+            if len(page_ids) < GET_BATCH_SIZE:
+                break
+            offset += len(page_ids)
+
+        E = self._normalize(rows) if ids else np.empty((0, 0), dtype=np.float32)
+        return ids, docs, metas, E
+
+    def _install_local_index(self, snapshot, generation: int) -> bool:
+        """Swap a fetched snapshot in (lock held), unless the mirror changed
+        since `generation` was read; then the snapshot may be stale and is
+        dropped."""
+        if self._generation != generation:
+            return False
+        ids, docs, metas, E = snapshot
+        self._reset_local_index()
+        self._E = E
+        self._ids = ids
+        self._docs = docs
+        self._metas = metas
+        self._pos = {cid: i for i, cid in enumerate(ids)}
+        self._index_loaded = True
+        return True
+
+    def _update_local_index(self, chunk_ids, texts, embeddings, metadata):
+        """Apply an upsert to the in-process mirror (replace or append rows)."""
+        self._generation += 1
+        if not self._index_loaded:
+            return
+        new_rows = self._normalize(embeddings)
+        append = []
+        for row, (cid, text, meta) in enumerate(zip(chunk_ids, texts, metadata)):
+            i = self._pos.get(cid)
+            if i is None:
+                append.append(row)
+                self._pos[cid] = len(self._ids)
+                self._ids.append(cid)
+                self._docs.append(text)
+                self._metas.append(meta)
+            else:
+                self._E[i] = new_rows[row]
+                self._docs[i] = text
+                self._metas[i] = meta
+        if append:
+            self._E = new_rows[append] if self._E.size == 0 else np.vstack([self._E, new_rows[append]])
+        if len(self._ids) > LOCAL_INDEX_MAX:
+            self._reset_local_index()
+
+    def _query_local(self, embedding: np.ndarray, top_k: int, include_embeddings: bool = False):
+        """Exact cosine top-k over the in-process mirror."""
+        n = len(self._ids)
+        k = min(top_k, n)
+        if k <= 0:
+            results = {"ids": [], "documents": [], "distances": [], "metadatas": []}
+            if include_embeddings:
+                results["embeddings"] = []
+            return results
+
+        q = np.asarray(embedding, dtype=np.float32)
+        q_norm = np.linalg.norm(q)
+        if q_norm > 0:
+            q = q / q_norm
+        scores = self._E @ q
+        idx = np.argpartition(-scores, k - 1)[:k]
+        idx = idx[np.argsort(-scores[idx], kind="stable")]
+
+        results = {
+            "ids": [self._ids[i] for i in idx],
+            "documents": [self._docs[i] for i in idx],
+            # Same convention as Chroma's cosine space: distance = 1 - similarity
+            "distances": (1.0 - scores[idx]).tolist(),
+            "metadatas": [self._metas[i] for i in idx],
+        }
+        if include_embeddings:
+            results["embeddings"] = self._E[idx]
+        return results
 
     def upsert_chunks(
         self,
         chunk_ids: List[str],
         texts: List[str],
-        embeddings: List[List[float]],
+        embeddings: np.ndarray,
         metadata: List[Dict],
     ):
         if not self.collection:
             raise RuntimeError("Collection not initialized")
 
+        # Chroma ships embeddings as base64-packed float32, so narrower dtypes
+        # would not shrink the payload. A float32 matrix (what the embedder
+        # returns) passes straight through, skipping per-row list conversion.
         self.collection.upsert(
             ids=chunk_ids,
             documents=texts,
-            embeddings=embeddings,
+            embeddings=np.asarray(embeddings, dtype=np.float32),
             metadatas=metadata,
         )
+        with self._lock:
+            self._update_local_index(chunk_ids, texts, embeddings, metadata)
+
+    def query_similar(
+        self,
+        embedding: np.ndarray,
+        top_k: int = 5,
+        include_embeddings: bool = False,
+    ):
+        """Return the top_k chunks closest to `embedding`.
 
-    def query_similar(self, embedding: List[float], top_k: int = 5):
+        With `include_embeddings` the result also carries the matched
+        chunks' embeddings (e.g. for mmr_rerank).
+        """
         if not self.collection:
             raise RuntimeError("Collection not initialized")
 
+        # Small collections: exact, deterministic top-k computed locally.
+        # Other processes (e.g. other gunicorn workers) may write to the same
+        # collection, so a count mismatch triggers a reload of the mirror. A
+        # reset followed by an upload of the same size keeps the count, so a
+        # sampled mirrored id must also still exist.
+        count = self.collection.count()
+        if count <= LOCAL_INDEX_MAX:
+            with self._lock:
+                fresh = self._index_loaded and count == len(self._ids)
+                sample = random.choice(self._ids) if fresh and self._ids else None
+                generation = self._generation
+            if sample is not None:
+                found = self.collection.get(ids=[sample], include=[]).get("ids", [])
+                fresh = sample in found
+            if not fresh:
+                # Fetched without the lock so other queries aren't stuck
+                # behind the paging round trips
+                snapshot = self._fetch_local_index()
+                with self._lock:
+                    fresh = self._install_local_index(snapshot, generation)
+            if fresh:
+                with self._lock:
+                    return self._query_local(embedding, top_k, include_embeddings)
+            # Raced with a local upsert/reset; let Chroma answer this one
+
+        with self._lock:
+            if count > LOCAL_INDEX_MAX and self._index_loaded:
+                self._reset_local_index()
+
+        include = ["documents", "distances", "metadatas"]
+        if include_embeddings:
+            include.append("embeddings")
         results = self.collection.query(
             query_embeddings=[embedding],
             n_results=top_k,
-            include=["documents", "distances", "metadatas"],
+            include=include,
         )
 
-        return {
+        formatted = {
             "ids": results["ids"][0],
             "documents": results["documents"][0],
             "distances": results["distances"][0],
             "metadatas": results["metadatas"][0],
         }
+        if include_embeddings:
+            formatted["embeddings"] = results["embeddings"][0]
+        return formatted
 
     def reset_collection(self, collection_name: str):
         if self.collection:
@@ -69,13 +330,21 @@ class ChromaClient:
         except:
             return {"connected": False}
 
-    def get_all_documents(self, limit: int = 100):
-        """Retrieve all documents from the collection with pagination support."""
+    def get_all_documents(self, limit: int = 100, ids_only: bool = False):
+        """Retrieve all documents from the collection with pagination support.
+
+        With `ids_only`, no documents or metadata are transferred and each
+        entry carries just its id.
+        """
         if not self.collection:
             return []
 
         try:
-            results = self.collection.get(limit=limit)
+            if ids_only:
+                results = self.collection.get(limit=limit, include=[])
+                return [{"id": cid} for cid in results.get("ids", [])]
+
+            results = self.collection.get(limit=limit, include=["documents", "metadatas"])
             documents = []
             for i in range(len(results.get("ids", []))):
                 documents.append({
@@ -88,36 +357,53 @@ class ChromaClient:
             raise RuntimeError(f"ChromaDB get error: {e}")
 
     def count_documents(self):
-        """Return total number of documents using paged GET requests.
+        """Return total number of documents.
 
-        Chroma Cloud enforces a maximum `limit` per GET (e.g. 300). Requesting
-        a very large limit causes a quota error. To avoid that, page through
-        results using a safe batch size (defaults to 300) until fewer than
-        `batch_size` items are returned.
+        Uses the collection's native count() when available. Otherwise pages
+        through GET requests: Chroma Cloud enforces a maximum `limit` per GET
+        (e.g. 300), and requesting a very large limit causes a quota error.
         """
         if not self.collection:
             return 0
 
-        batch_size = 300
-        total = 0
-        offset = 0
-
         try:
-            while True:
-                # collection.get supports limit and offset in the Cloud SDK
-                results = self.collection.get(limit=batch_size, offset=offset)
-                ids = results.get("ids", [])
-                chunk_count = len(ids)
-                total += chunk_count
-                if chunk_count < batch_size:
-                    break
-                offset += chunk_count
+            return self.collection.count()
+        except Exception as e:
+            print(f"[WARNING] collection.count() failed ({e}), counting by paging")
 
-            return total
+        batch_size = GET_BATCH_SIZE
+
+        try:
+            return self._count_by_paging(batch_size)
         except Exception as e:
             # If paging fails for any reason, fall back to a safe single GET
             try:
-                results = self.collection.get(limit=batch_size)
+                results = self.collection.get(limit=batch_size, include=[])
                 return len(results.get("ids", []))
             except Exception as e2:
                 raise RuntimeError(f"ChromaDB count error: {e} | fallback error: {e2}")
+
+    def _count_by_paging(self, batch_size: int) -> int:
+        """Count by fetching pages concurrently, a wave of offsets at a time."""
+
+        def page_size(offset: int) -> int:
+            # collection.get supports limit and offset in the Cloud SDK;
+            # ids come back regardless, so skip every other payload
+            results = self.collection.get(limit=batch_size, offset=offset, include=[])
+            return len(results.get("ids", []))
+
+        # Probe the first page; small collections need nothing more
+        total = page_size(0)
+        if total < batch_size:
+            return total
+
+        offset = batch_size
+        with ThreadPoolExecutor(max_workers=COUNT_MAX_WORKERS) as executor:
+            while True:
+                offsets = range(offset, offset + COUNT_MAX_WORKERS * batch_size, batch_size)
+                for chunk_count in executor.map(page_size, offsets):
+                    total += chunk_count
+                    # A short page marks the end; later pages are empty
+                    if chunk_count < batch_size:
+                        return total
+                offset = offsets[-1] + batch_size
@@ -1,37 +1,114 @@
 import re
-from typing import List, Tuple
+from bisect import bisect_left, bisect_right
+from typing import BinaryIO, List, Optional, Tuple
 
 
-def extract_text(file_path: str) -> str:
-    """Extract text from .txt, .md, or .pdf files."""
-    if file_path.endswith(".pdf"):
+def extract_text(fileobj: BinaryIO, suffix: str) -> str:
+    """Extract text from a binary file-like object holding a .txt, .md, or .pdf file.
+
+    The object is consumed directly, so uploads never need a temp file copy.
+    """
+    if suffix.lower() == ".pdf":
         # Simple PDF support via PyPDF2 (optional)
         try:
             import PyPDF2
-            with open(file_path, "rb") as f:
-                reader = PyPDF2.PdfReader(f)
-                # Some pages may return None from extract_text(); filter those
-                parts = []
-                for page in reader.pages:
-                    p = page.extract_text()
-                    if p:
-                        parts.append(p)
-                text = "\n".join(parts)
-                return text
         except ImportError:
             raise RuntimeError("PyPDF2 not installed for PDF support")
+        reader = PyPDF2.PdfReader(fileobj)
+        # Some pages may return None from extract_text(); filter those
+        parts = []
+        for page in reader.pages:
+            p = page.extract_text()
+            if p:
+                parts.append(p)
+        text = "\n".join(parts)
+        return text
     else:
         # .txt, .md
-        # Try UTF-8 first, then fall back to latin1 or ignore errors
-        for encoding in ["utf-8", "latin1", "utf-8-sig"]:
-            try:
-                with open(file_path, "r", encoding=encoding) as f:
-                    return f.read()
-            except (UnicodeDecodeError, LookupError):
-                continue
-        # Final fallback: read as UTF-8 and ignore decode errors
-        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
-            return f.read()
+        # Read the bytes once; every decode attempt works on the same buffer.
+        # utf-8-sig accepts plain UTF-8 and also strips a BOM if present.
+        raw = fileobj.read()
+        try:
+            return raw.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            # latin1 maps every byte, so this cannot fail
+            return raw.decode("latin1")
+
+
+# Positions right after a sentence end (or paragraph break) and after any
+# run of whitespace; chunks prefer to end on the former, then the latter.
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*\s+|\n\s*\n")
+_WORD_END = re.compile(r"\s+")
+
+
+def chunk_spans(text: str, chunk_size: int = 500, overlap: int = 50) -> List[Tuple[int, int]]:
+    """
+    Compute overlapping, sentence-aligned chunk boundaries without copying the text.
+    Args:
+        text: Input text
+        chunk_size: Maximum chunk size in characters
+        overlap: Approximate overlap between consecutive chunks in characters
+    Returns:
+        List of (start, end) character offsets, trimmed of surrounding
+        whitespace, for every non-empty chunk
+    """
+    n = len(text)
+    # Boundary offsets are found once by the regex engine; each window is
+    # then picked with a binary search rather than a character walk.
+    sentences = [m.end() for m in _SENTENCE_END.finditer(text)]
+    words = [m.end() for m in _WORD_END.finditer(text)]
+    # Backing up a full chunk or more would stall the window
+    overlap = min(overlap, chunk_size - 1)
+
+    spans = []
+    start = 0
+    prev_end = 0
+    while start < n:
+        limit = start + chunk_size
+        # Every chunk must reach past the previous one, or it would sit
+        # entirely inside it
+        floor = max(start, prev_end)
+        if limit >= n:
+            end = n
+        else:
+            # Last sentence boundary that fits (unless that leaves the chunk
+            # under half full), else last word boundary, else a hard cut for
+            # a single overlong word
+            end = _last_boundary(sentences, floor, limit)
+            if end is None or end - start < chunk_size // 2:
+                end = _last_boundary(words, floor, limit)
+            if end is None:
+                end = limit
+
+        # Equivalent to text[start:end].strip(), but only moves the bounds
+        s, e = start, end
+        while s < e and text[s].isspace():
+            s += 1
+        while e > s and text[e - 1].isspace():
+            e -= 1
+        if s < e and (not spans or e > spans[-1][1]):
+            if spans and s <= spans[-1][0]:
+                # Only whitespace was skipped; this span supersedes the last
+                spans[-1] = (s, e)
+            else:
+                spans.append((s, e))
+
+        if end >= n:
+            break
+        prev_end = end
+        # Back up by roughly `overlap` characters, starting on a word
+        i = bisect_left(words, end - overlap)
+        next_start = words[i] if i < len(words) else end
+        start = next_start if start < next_start < end else end
+    return spans
+
+
+def _last_boundary(bounds: List[int], floor: int, limit: int) -> Optional[int]:
+    """Largest offset in sorted `bounds` with floor < offset <= limit, if any."""
+    i = bisect_right(bounds, limit) - 1
+    if i >= 0 and bounds[i] > floor:
+        return bounds[i]
+    return None
 
 
 def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
@@ -47,11 +124,5 @@ def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]
     if len(text) <= chunk_size:
         return [text]
 
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = min(start + chunk_size, len(text))
-        chunk = text[start:end]
-        chunks.append(chunk.strip())
-        start = end - overlap if end < len(text) else len(text)
-    return [c for c in chunks if c]  # Filter empty chunks
+    # Only the surviving, already-trimmed chunks are materialized
+    return [text[s:e] for s, e in chunk_spans(text, chunk_size, overlap)]
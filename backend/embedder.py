@@ -2,7 +2,46 @@ import os
 import requests
 from typing import List
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import numpy as np
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Gemini's batchEmbedContents accepts at most 100 requests per call.
+GEMINI_BATCH_LIMIT = 100
+# Statuses from batchEmbedContents meaning the endpoint itself is unavailable
+BATCH_UNAVAILABLE_STATUSES = (404, 405, 501)
+# Concurrent embedContent calls when the batch endpoint is unavailable.
+EMBED_MAX_WORKERS = 8
+# Batches of a large document that are embedded concurrently.
+EMBED_MAX_BATCHES_IN_FLIGHT = 4
+# Query embeddings remembered by embed_single (repeat queries skip the API).
+EMBED_CACHE_SIZE = 1024
+
+# Shared keep-alive session for every Gemini call (embeddings and answer
+# generation), so TCP/TLS connections are reused instead of re-handshaking.
+# Sized for EMBED_MAX_BATCHES_IN_FLIGHT * EMBED_MAX_WORKERS concurrent calls.
+# Rate limits (429) and transient 5xx errors are retried with backoff. Read
+# timeouts are not: the timeout already bounds the call, and retrying it
+# would multiply the wait before callers can fall back.
+GEMINI_SESSION = requests.Session()
+GEMINI_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            read=False,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False,
+        ),
+    ),
+)
 
 
 class GeminiEmbedder:
@@ -10,64 +49,168 @@ class GeminiEmbedder:
 
     def __init__(self, api_key: str):
         self.api_key = api_key
-        self.base_url = "https://generativelanguage.googleapis.com/v1"
+        self.base_url = "https://generativelanguage.googleapis.com/v1beta"
         self.model = "text-embedding-004"
         # Gemini embeddings may be 3072-dim depending on model/version; use 3072
         # to match collection expectations in Chroma Cloud. Fallbacks will
         # generate vectors of this size for local testing.
         self.embedding_dim = 3072
+        # Flipped off the first time batchEmbedContents is rejected so later
+        # batches go straight to the per-text endpoint.
+        self._batch_supported = True
+        # Set once embedContent itself 404s: the model is unavailable, so
+        # every later batch goes straight to the local fallback.
+        self._model_missing = False
+        # Per-instance so the cache never outlives (or leaks across) embedders.
+        # A text's embedding does not depend on the indexed documents, so no
+        # invalidation is needed.
+        self._embed_cached = lru_cache(maxsize=EMBED_CACHE_SIZE)(self._embed_uncached)
 
-    def embed_texts(self, texts: List[str], batch_size: int = 100) -> List[List[float]]:
+    def embed_texts(self, texts: List[str], batch_size: int = GEMINI_BATCH_LIMIT) -> np.ndarray:
         """
         Embed a list of texts using Gemini API with batching.
-        Returns list of 768-dim embeddings.
+        Each batch is sent as a single batchEmbedContents request, so N texts
+        cost ceil(N / batch_size) round trips instead of N; when there are
+        several batches they are in flight concurrently.
+        Returns a contiguous float32 array of shape (len(texts), dim).
         """
-        embeddings = []
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i : i + batch_size]
-            batch_embeddings = self._embed_batch(batch)
-            embeddings.extend(batch_embeddings)
+        batch_size = max(1, min(batch_size, GEMINI_BATCH_LIMIT))
+        batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+        if not batches:
+            return np.empty((0, self.embedding_dim), dtype=np.float32)
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+
+        embeddings = None
+        workers = min(EMBED_MAX_BATCHES_IN_FLIGHT, len(batches))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # executor.map yields batches in input order
+            for i, batch_embeddings in enumerate(executor.map(self._embed_batch, batches)):
+                if embeddings is None:
+                    # The API's dimension may differ from the fallback's
+                    embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+                start = i * batch_size
+                embeddings[start : start + len(batch_embeddings)] = batch_embeddings
         return embeddings
 
-    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
-        """Embed a single batch of texts."""
-        url = f"{self.base_url}/models/{self.model}:embedContent"
-        embeddings = []
-        
-        for text in texts:
-            payload = {
-                "model": f"models/{self.model}",
-                "content": {
-                    "parts": [{"text": text}]
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed a single batch of texts with one batchEmbedContents call.
+
+        Falls back to concurrent per-text embedContent calls when the batch
+        endpoint is not available, and to local deterministic embeddings when
+        the model itself cannot be found.
+        """
+        if self._model_missing:
+            return self._fallback_embeddings(texts)
+        try:
+            if self._batch_supported:
+                try:
+                    return self._embed_batch_request(texts)
+                except requests.HTTPError as e:
+                    # Only "endpoint missing" answers are latched; a 400 is a
+                    # problem with this request (bad key, bad payload) and
+                    # propagates like any other error
+                    if e.response is None or e.response.status_code not in BATCH_UNAVAILABLE_STATUSES:
+                        raise
+                    print(f"[WARNING] batchEmbedContents unavailable ({e}), using per-text requests")
+                    self._batch_supported = False
+            return self._embed_concurrent(texts)
+        except requests.HTTPError as e:
+            # If model not found or other HTTP error, fall back to local deterministic embeddings
+            if e.response is not None and e.response.status_code == 404:
+                if not self._model_missing:
+                    print(f"[WARNING] Embedding model unavailable ({e}), using local fallback embeddings")
+                    self._model_missing = True
+                return self._fallback_embeddings(texts)
+            raise RuntimeError(f"Gemini API error: {e}")
+        except requests.RequestException as e:
+            raise RuntimeError(f"Gemini API error: {e}")
+
+    def _embed_batch_request(self, texts: List[str]) -> np.ndarray:
+        """POST the whole batch to batchEmbedContents."""
+        url = f"{self.base_url}/models/{self.model}:batchEmbedContents"
+        payload = {
+            "requests": [
+                {
+                    "model": f"models/{self.model}",
+                    "content": {"parts": [{"text": text}]},
                 }
-            }
-            headers = {"Content-Type": "application/json"}
-            params = {"key": self.api_key}
-
-            try:
-                response = requests.post(url, json=payload, headers=headers, params=params, timeout=30)
-                response.raise_for_status()
-                data = response.json()
-                # Extract embedding from response
-                if "embedding" in data and "values" in data["embedding"]:
-                    embeddings.append(data["embedding"]["values"])
-                else:
-                    raise ValueError(f"Unexpected API response format: {data}")
-            except requests.HTTPError as e:
-                # If model not found or other HTTP error, fall back to local deterministic embeddings
-                if e.response is not None and e.response.status_code == 404:
-                    # Fallback: deterministic embedding based on sha256 hash
-                    for text in texts:
-                        seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16) % (2**32)
-                        rng = np.random.RandomState(seed)
-                        embeddings.append(rng.rand(self.embedding_dim).tolist())
-                    return embeddings
-                raise RuntimeError(f"Gemini API error: {e}")
-            except requests.RequestException as e:
-                raise RuntimeError(f"Gemini API error: {e}")
-        
-        return embeddings
+                for text in texts
+            ]
+        }
+        headers = {"Content-Type": "application/json"}
+        params = {"key": self.api_key}
+
+        response = GEMINI_SESSION.post(url, json=payload, headers=headers, params=params, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        # Embeddings come back in the same order as the requests
+        items = data.get("embeddings")
+        if not isinstance(items, list) or len(items) != len(texts):
+            raise ValueError(f"Unexpected API response format: {data}")
+        if any("values" not in item for item in items):
+            raise ValueError(f"Unexpected API response format: {data}")
+        return np.asarray([item["values"] for item in items], dtype=np.float32)
+
+    def _embed_one(self, text: str) -> List[float]:
+        """POST a single text to embedContent."""
+        url = f"{self.base_url}/models/{self.model}:embedContent"
+        payload = {
+            "model": f"models/{self.model}",
+            "content": {"parts": [{"text": text}]},
+        }
+        headers = {"Content-Type": "application/json"}
+        params = {"key": self.api_key}
+
+        response = GEMINI_SESSION.post(url, json=payload, headers=headers, params=params, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        if "embedding" in data and "values" in data["embedding"]:
+            return data["embedding"]["values"]
+        raise ValueError(f"Unexpected API response format: {data}")
+
+    def _embed_concurrent(self, texts: List[str]) -> np.ndarray:
+        """Issue one embedContent call per text, overlapping them on a thread pool.
+
+        The first text is sent alone as a probe, so a missing model costs one
+        doomed request rather than one per text.
+        """
+        first = self._embed_one(texts[0])
+        rest = texts[1:]
+        if not rest:
+            return np.asarray([first], dtype=np.float32)
+        workers = min(EMBED_MAX_WORKERS, len(rest))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # executor.map yields results in input order
+            return np.asarray([first] + list(executor.map(self._embed_one, rest)), dtype=np.float32)
+
+    def _fallback_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Deterministic embeddings derived from the sha256 hash of each text.
+
+        Every vector is a pure function of its own text (never of the rest of
+        the batch), so a query embeds to the same vector as an identical chunk.
+        The whole (N, dim) block is generated with one vectorized splitmix64
+        pass instead of a RandomState per text.
+        """
+        seeds = np.frombuffer(
+            b"".join(hashlib.sha256(text.encode("utf-8")).digest()[:8] for text in texts),
+            dtype="<u8",
+        )
+        counters = np.arange(1, self.embedding_dim + 1, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            x = seeds[:, None] + counters[None, :] * np.uint64(0x9E3779B97F4A7C15)
+            x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            x ^= x >> np.uint64(31)
+        # Top 24 bits map exactly onto float32's mantissa, giving values in [0, 1)
+        return (x >> np.uint64(40)).astype(np.float32) * np.float32(1.0 / (1 << 24))
+
+    def _embed_uncached(self, text: str) -> np.ndarray:
+        embedding = self._embed_batch([text])[0]
+        # Shared by every caller via the cache, so keep it immutable
+        embedding.setflags(write=False)
+        return embedding
 
-    def embed_single(self, text: str) -> List[float]:
-        """Embed a single text."""
-        return self._embed_batch([text])[0]
+    def embed_single(self, text: str) -> np.ndarray:
+        """Embed a single text, reusing the result for repeated texts."""
+        return self._embed_cached(text)
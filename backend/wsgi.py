@@ -0,0 +1,11 @@
+"""WSGI entry point for production servers.
+
+All handlers are network-bound (Gemini + Chroma), so gevent workers give
+cheap concurrency:
+
+    cd backend
+    gunicorn -k gevent -w 2 --worker-connections 1000 -b 0.0.0.0:5001 wsgi:app
+"""
+from app import app
+
+__all__ = ["app"]
@@ -67,7 +67,7 @@
       data.results.forEach(r =>{
         const el = document.createElement('div');
         el.className='result-item';
-        el.innerHTML = `<div class='rank'>#${r.rank}</div><div class='score'>score: ${r.similarity_score}</div><div class='text'>${escapeHtml(r.text)}</div><div class='meta'>${escapeHtml(JSON.stringify(r.metadata))}</div>`;
+        el.innerHTML = `<div class='rank'>#${r.rank}</div><div class='score'>score: ${r.similarity_score == null ? 'n/a' : r.similarity_score.toFixed(4)}</div><div class='text'>${escapeHtml(r.text)}</div><div class='meta'>${escapeHtml(JSON.stringify(r.metadata))}</div>`;
         queryResult.appendChild(el);
       });
     }catch(e){ queryResult.textContent = 'Query error: '+e.message; }
@@ -0,0 +1,166 @@
+import io
+
+import numpy as np
+import orjson
+import pytest
+import requests
+
+import app as app_module
+
+
+SOURCES = [{"rank": 1, "text": "chunk text", "chunk_id": "c1", "metadata": {}, "similarity_score": 0.9}]
+
+
+class FakeStream:
+    def __init__(self, lines, fail_after=None):
+        self.lines = lines
+        self.fail_after = fail_after
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self):
+        for i, line in enumerate(self.lines):
+            if i == self.fail_after:
+                raise requests.ConnectionError("connection reset")
+            yield line
+
+
+def sse(text):
+    return b"data: " + orjson.dumps({"candidates": [{"content": {"parts": [{"text": text}]}}]})
+
+
+def parse_events(body):
+    """Split an SSE body into (event, data) pairs."""
+    events = []
+    for frame in body.decode().strip().split("\n\n"):
+        name, data = "message", None
+        for line in frame.split("\n"):
+            if line.startswith("event: "):
+                name = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = orjson.loads(line[len("data: "):])
+        events.append((name, data))
+    return events
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app_module, "CLIENTS_OK", True)
+    monkeypatch.setattr(app_module, "_answer_sources", lambda query_text, top_k: SOURCES)
+    monkeypatch.setenv("GOOGLE_API_KEY", "key")
+    app_module.ANSWER_CACHE.clear()
+    return app_module.app.test_client()
+
+
+def test_answer_stream_framing_and_cache(client, monkeypatch):
+    stream = FakeStream([sse("Hello\nwor"), b"", sse("ld")])
+    monkeypatch.setattr(app_module.GEMINI_SESSION, "post", lambda *a, **k: stream)
+
+    resp = client.post("/api/answer/stream", json={"query": "q"})
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+
+    events = parse_events(resp.data)
+    assert events[0] == ("sources", {"sources": SOURCES, "source_count": 1})
+    assert events[1:3] == [("message", {"text": "Hello\nwor"}), ("message", {"text": "ld"})]
+    assert events[-1] == ("done", {})
+    assert list(app_module.ANSWER_CACHE.values()) == ["Hello\nworld"]
+
+
+def test_interrupted_stream_is_reported_and_not_cached(client, monkeypatch):
+    stream = FakeStream([sse("partial"), sse("never sent")], fail_after=1)
+    monkeypatch.setattr(app_module.GEMINI_SESSION, "post", lambda *a, **k: stream)
+
+    events = parse_events(client.post("/api/answer/stream", json={"query": "q"}).data)
+    names = [name for name, _ in events]
+    assert names == ["sources", "message", "error"]
+    assert events[-1][1]["truncated"] is True
+    assert len(app_module.ANSWER_CACHE) == 0
+
+
+def test_failure_before_first_piece_streams_fallback(client, monkeypatch):
+    def boom(*a, **k):
+        raise requests.ConnectionError("down")
+
+    monkeypatch.setattr(app_module.GEMINI_SESSION, "post", boom)
+
+    events = parse_events(client.post("/api/answer/stream", json={"query": "q"}).data)
+    assert [name for name, _ in events] == ["sources", "message", "done"]
+    assert events[1][1]["text"].startswith("Based on the documents:")
+    assert len(app_module.ANSWER_CACHE) == 0
+
+
+def test_answer_stream_requires_query(client):
+    resp = client.post("/api/answer/stream", json={})
+    assert resp.status_code == 400
+
+
+class FakeChroma:
+    def __init__(self):
+        self.upserts = 0
+        self.resets = 0
+
+    def upsert_chunks(self, *args):
+        self.upserts += 1
+
+    def reset_collection(self, name):
+        self.resets += 1
+
+
+class FakeEmbedder:
+    def embed_texts(self, texts):
+        return np.zeros((len(texts), 4), dtype=np.float32)
+
+
+class FakeAnswer:
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"candidates": [{"content": {"parts": [{"text": "model answer"}]}}]}
+
+
+def test_upload_and_reset_invalidate_answer_cache(client, monkeypatch):
+    monkeypatch.setattr(app_module, "chroma", FakeChroma(), raising=False)
+    monkeypatch.setattr(app_module, "embedder", FakeEmbedder())
+    posts = []
+    monkeypatch.setattr(app_module.GEMINI_SESSION, "post", lambda *a, **k: posts.append(1) or FakeAnswer())
+
+    assert app_module.generate_answer("q", SOURCES) == "model answer"
+    assert app_module.generate_answer("q", SOURCES) == "model answer"
+    assert len(posts) == 1
+    assert len(app_module.ANSWER_CACHE) == 1
+
+    version = app_module.DOCS_VERSION
+    resp = client.post("/api/upload", data={"file": (io.BytesIO(b"some document text"), "doc.txt")})
+    assert resp.status_code == 200
+    assert app_module.DOCS_VERSION == version + 1
+    assert len(app_module.ANSWER_CACHE) == 0
+
+    app_module.generate_answer("q", SOURCES)
+    assert len(posts) == 2
+
+    assert client.delete("/api/reset").status_code == 200
+    assert app_module.DOCS_VERSION == version + 2
+    assert len(app_module.ANSWER_CACHE) == 0
+
+
+def test_fallback_answers_are_not_cached(client, monkeypatch):
+    def boom(*a, **k):
+        raise requests.ConnectionError("down")
+
+    monkeypatch.setattr(app_module.GEMINI_SESSION, "post", boom)
+    answer = app_module.generate_answer("q", SOURCES)
+    assert answer.startswith("Based on the documents:")
+    assert len(app_module.ANSWER_CACHE) == 0
+
+    monkeypatch.delenv("GOOGLE_API_KEY")
+    app_module.generate_answer("q", SOURCES)
+    assert len(app_module.ANSWER_CACHE) == 0
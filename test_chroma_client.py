@@ -0,0 +1,272 @@
+import threading
+import uuid
+
+import chromadb
+import numpy as np
+import pytest
+
+import chroma_client
+from chroma_client import ChromaClient, format_results, mmr_rerank
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Same code path as production, backed by an in-memory Chroma
+    monkeypatch.setattr(chromadb, "CloudClient", lambda **kwargs: chromadb.EphemeralClient())
+    c = ChromaClient(api_key="key", tenant_id="tenant", database_name="db")
+    c.get_or_create_collection(f"test-{uuid.uuid4().hex[:8]}")
+    return c
+
+
+def upsert(c, n, dim=8, seed=0, prefix="id"):
+    rng = np.random.default_rng(seed)
+    E = rng.random((n, dim)).astype(np.float32)
+    ids = [f"{prefix}{i}" for i in range(n)]
+    c.upsert_chunks(ids, [f"doc {i}" for i in ids], E, [{"n": i} for i in range(n)])
+    return ids, E
+
+
+def test_local_top_k_matches_chroma(client):
+    upsert(client, 200)
+    q = np.random.default_rng(1).random(8).astype(np.float32)
+
+    local = client.query_similar(q, top_k=5)
+    assert client._index_loaded
+    remote = client.collection.query(query_embeddings=[q], n_results=5)
+
+    assert local["ids"] == remote["ids"][0]
+    np.testing.assert_allclose(local["distances"], remote["distances"][0], atol=1e-5)
+    assert local["documents"] == [f"doc {i}" for i in local["ids"]]
+
+
+def test_top_k_larger_than_collection(client):
+    upsert(client, 3)
+    results = client.query_similar(np.ones(8, dtype=np.float32), top_k=10)
+    assert len(results["ids"]) == 3
+
+
+def test_update_replaces_and_appends_rows(client):
+    ids, E = upsert(client, 10)
+    client.query_similar(E[0], top_k=1)  # loads the mirror
+    assert client._index_loaded
+
+    target = np.zeros(8, dtype=np.float32)
+    target[0] = 1.0
+    # Replace an existing id and append a new one in one upsert
+    client.upsert_chunks(
+        ["id3", "new"],
+        ["replaced", "appended"],
+        np.stack([target, -target]),
+        [{"n": 3}, {"n": 99}],
+    )
+    assert len(client._ids) == 11
+    assert client._docs[client._pos["id3"]] == "replaced"
+
+    results = client.query_similar(target, top_k=1)
+    assert results["ids"] == ["id3"]
+    results = client.query_similar(-target, top_k=1)
+    assert results["ids"] == ["new"]
+    assert results["documents"] == ["appended"]
+
+
+def test_reload_when_count_changes_elsewhere(client):
+    ids, E = upsert(client, 10)
+    client.query_similar(E[0], top_k=1)
+
+    # Another process writes straight to the collection
+    outside = np.full(8, -1.0, dtype=np.float32)
+    client.collection.upsert(ids=["outside"], embeddings=[outside], documents=["x"], metadatas=[{"n": -1}])
+
+    results = client.query_similar(outside, top_k=1)
+    assert results["ids"] == ["outside"]
+    assert len(client._ids) == 11
+
+
+def test_reload_does_not_hold_lock_during_fetch(client, monkeypatch):
+    ids, E = upsert(client, 10)
+    fetch = client._fetch_local_index
+    lock_free = []
+
+    def probe():
+        acquired = client._lock.acquire(blocking=False)
+        lock_free.append(acquired)
+        if acquired:
+            client._lock.release()
+
+    def checking_fetch():
+        # Probe from another thread: an RLock held here would block it
+        t = threading.Thread(target=probe)
+        t.start()
+        t.join()
+        return fetch()
+
+    monkeypatch.setattr(client, "_fetch_local_index", checking_fetch)
+    client.query_similar(E[0], top_k=1)
+    assert lock_free == [True]
+
+
+def test_stale_snapshot_is_dropped(client):
+    upsert(client, 5)
+    generation = client._generation
+    snapshot = client._fetch_local_index()
+    upsert(client, 2, prefix="late")  # races with the fetch
+
+    assert not client._install_local_index(snapshot, generation)
+    assert not client._index_loaded
+
+
+def test_large_collections_use_chroma(client, monkeypatch):
+    ids, E = upsert(client, 20)
+    monkeypatch.setattr(chroma_client, "LOCAL_INDEX_MAX", 10)
+    results = client.query_similar(E[4], top_k=1)
+    assert results["ids"] == ["id4"]
+    assert not client._index_loaded
+
+
+def mmr_input(E, ids=None):
+    ids = ids or [f"id{i}" for i in range(len(E))]
+    return {
+        "ids": ids,
+        "documents": [f"doc {cid}" for cid in ids],
+        "distances": [0.1 * i for i in range(len(ids))],
+        "metadatas": [{"id": cid} for cid in ids],
+        "embeddings": np.asarray(E, dtype=np.float32),
+    }
+
+
+def test_mmr_prefers_diverse_row_over_near_duplicate():
+    E = [
+        [1.0, 0.0, 0.0],  # best match
+        [0.999, 0.0, 0.01],  # near-duplicate of the best match
+        [0.6, 0.8, 0.0],  # less relevant but different
+    ]
+    query = np.array([1.0, 0.3, 0.0], dtype=np.float32)
+
+    picked = mmr_rerank(mmr_input(E), query, top_k=2)
+    assert picked["ids"] == ["id0", "id2"]
+
+    # Pure relevance keeps the duplicate
+    picked = mmr_rerank(mmr_input(E), query, top_k=2, lambda_mult=1.0)
+    assert picked["ids"] == ["id0", "id1"]
+
+
+def test_mmr_keeps_fields_aligned():
+    rng = np.random.default_rng(0)
+    results = mmr_input(rng.random((8, 4)))
+    picked = mmr_rerank(results, rng.random(4), top_k=5)
+
+    assert len(picked["ids"]) == 5
+    assert len(set(picked["ids"])) == 5
+    for cid, doc, dist, meta in zip(picked["ids"], picked["documents"], picked["distances"], picked["metadatas"]):
+        i = results["ids"].index(cid)
+        assert doc == f"doc {cid}"
+        assert dist == results["distances"][i]
+        assert meta == {"id": cid}
+    assert "embeddings" not in picked
+
+
+def test_mmr_top_k_at_least_n_returns_everything():
+    picked = mmr_rerank(mmr_input([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]]), np.array([1.0, 0.0]), top_k=10)
+    assert sorted(picked["ids"]) == ["id0", "id1", "id2"]
+    assert picked["ids"][0] == "id0"
+
+
+def test_mmr_empty_input():
+    empty = {"ids": [], "documents": [], "distances": [], "metadatas": [], "embeddings": []}
+    assert mmr_rerank(empty, np.ones(3), top_k=5) == {
+        "ids": [], "documents": [], "distances": [], "metadatas": []
+    }
+
+
+class RecordingCollection:
+    """Proxy that records get() kwargs and can disable count()."""
+
+    def __init__(self, collection, count_works=True):
+        self._collection = collection
+        self._count_works = count_works
+        self.get_calls = []
+
+    def count(self):
+        if not self._count_works:
+            raise RuntimeError("count not supported")
+        return self._collection.count()
+
+    def get(self, **kwargs):
+        self.get_calls.append(kwargs)
+        return self._collection.get(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+def test_count_documents_uses_native_count(client):
+    upsert(client, 7)
+    client.collection = RecordingCollection(client.collection)
+    assert client.count_documents() == 7
+    assert client.collection.get_calls == []
+
+
+@pytest.mark.parametrize("n", [0, 1, 299, 300, 301, 2400, 2401, 2700])
+def test_count_documents_paging_fallback(client, n):
+    for start in range(0, n, 1000):
+        size = min(1000, n - start)
+        rng = np.random.default_rng(start)
+        client.collection.upsert(
+            ids=[f"id{i}" for i in range(start, start + size)],
+            embeddings=rng.random((size, 4)).astype(np.float32),
+        )
+    client.collection = RecordingCollection(client.collection, count_works=False)
+
+    assert client.count_documents() == n
+    # Counting only ever transfers ids
+    assert all(call["include"] == [] for call in client.collection.get_calls)
+
+
+def test_get_all_documents_ids_only(client):
+    upsert(client, 3)
+    client.collection = RecordingCollection(client.collection)
+
+    assert sorted(d["id"] for d in client.get_all_documents(ids_only=True)) == ["id0", "id1", "id2"]
+    assert client.collection.get_calls[-1]["include"] == []
+
+    docs = client.get_all_documents()
+    assert {d["id"]: d["text"] for d in docs}["id1"] == "doc id1"
+    assert "embeddings" not in client.collection.get_calls[-1]["include"]
+
+
+def test_format_results_ranks_rows():
+    results = {
+        "ids": ["a", "b"],
+        "documents": ["doc a", None],
+        "distances": [0.25, None],
+        "metadatas": [{"source": "f"}, None],
+    }
+    assert format_results(results) == [
+        {"rank": 1, "text": "doc a", "chunk_id": "a", "metadata": {"source": "f"}, "similarity_score": 0.75},
+        {"rank": 2, "text": "", "chunk_id": "b", "metadata": {}, "similarity_score": None},
+    ]
+
+
+def test_reload_after_reset_elsewhere_with_same_count(client):
+    ids, E = upsert(client, 5)
+    client.query_similar(E[0], top_k=1)
+
+    # Another worker resets the collection and uploads the same number of
+    # chunks under new ids
+    client.collection.delete(ids=ids)
+    rng = np.random.default_rng(1)
+    new_E = rng.random((5, 8)).astype(np.float32)
+    new_ids = [f"fresh{i}" for i in range(5)]
+    client.collection.upsert(ids=new_ids, embeddings=new_E, documents=new_ids)
+
+    results = client.query_similar(new_E[0], top_k=5)
+    assert sorted(results["ids"]) == sorted(new_ids)
+    assert set(client._ids) == set(new_ids)
+
+
+def test_new_collection_gets_hnsw_settings(client):
+    hnsw = client.collection.configuration_json["hnsw"]
+    assert hnsw["space"] == "cosine"
+    assert hnsw["ef_construction"] == 200
+    assert hnsw["ef_search"] == 64
+    assert hnsw["max_neighbors"] == 32
@@ -0,0 +1,84 @@
+import io
+import random
+
+import pytest
+
+from document_processor import chunk_spans, chunk_text, extract_text
+
+
+def assert_valid_spans(text, spans, chunk_size):
+    assert all(e - s <= chunk_size for s, e in spans)
+    covered = set()
+    for s, e in spans:
+        covered.update(range(s, e))
+    missing = [i for i, ch in enumerate(text) if not ch.isspace() and i not in covered]
+    assert not missing, f"uncovered offsets: {missing[:10]}"
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "word " * 2000,
+        "# Title\n- item one\n- item two\n" * 100,
+        "x" * 600 + " rest" * 300,
+        "y" * 1700,
+        "First sentence here. " * 200,
+    ],
+)
+def test_chunk_spans_respects_size_and_covers_text(text):
+    spans = chunk_spans(text, chunk_size=500, overlap=50)
+    assert len(spans) > 1
+    assert_valid_spans(text, spans, 500)
+
+
+def test_chunk_spans_random_text():
+    rng = random.Random(0)
+    for _ in range(300):
+        text = "".join(rng.choice("ab. \n!x") for _ in range(rng.randint(0, 2000)))
+        for chunk_size, overlap in [(500, 50), (20, 10), (20, 15), (10, 30)]:
+            assert_valid_spans(text, chunk_spans(text, chunk_size, overlap), chunk_size)
+
+
+def test_chunk_spans_never_nest_inside_previous_span():
+    rng = random.Random(1)
+    for _ in range(300):
+        text = "".join(rng.choice("ab. \n!x") for _ in range(rng.randint(0, 400)))
+        spans = chunk_spans(text, chunk_size=20, overlap=10)
+        for (s1, e1), (s2, e2) in zip(spans, spans[1:]):
+            assert s2 > s1 and e2 > e1
+
+
+def test_chunk_spans_prefers_sentence_boundaries():
+    text = ("This is one sentence. " * 40).strip()
+    for s, e in chunk_spans(text, chunk_size=500, overlap=50)[:-1]:
+        assert text[e - 1] == "."
+
+
+def test_chunk_text_short_text_is_single_chunk():
+    assert chunk_text("short text") == ["short text"]
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        ("héllo".encode("utf-8"), "héllo"),
+        ("\ufeffhéllo".encode("utf-8"), "héllo"),  # BOM is stripped
+        ("héllo".encode("latin1"), "héllo"),  # not valid UTF-8
+        (b"", ""),
+    ],
+)
+def test_extract_text_decoding(raw, expected):
+    assert extract_text(io.BytesIO(raw), ".txt") == expected
+
+
+def test_extract_text_reads_stream_once():
+    class OneShot(io.BytesIO):
+        reads = 0
+
+        def read(self, *args):
+            self.reads += 1
+            return super().read(*args)
+
+    stream = OneShot("caf\xe9".encode("latin1"))
+    assert extract_text(stream, ".md") == "café"
+    assert stream.reads == 1
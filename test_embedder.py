@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+import requests
+
+import embedder
+from embedder import GeminiEmbedder
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error", response=self)
+
+    def json(self):
+        return self._payload
+
+
+def fake_post(routes, calls):
+    """Route GEMINI_SESSION.post by endpoint suffix to a status code."""
+
+    def post(url, json=None, **kwargs):
+        method = url.rsplit(":", 1)[1]
+        calls.append(method)
+        status = routes[method]
+        if status != 200:
+            return FakeResponse(status)
+        if method == "batchEmbedContents":
+            return FakeResponse(200, {"embeddings": [{"values": [1.0, 2.0]} for _ in json["requests"]]})
+        return FakeResponse(200, {"embedding": {"values": [3.0, 4.0]}})
+
+    return post
+
+
+@pytest.mark.parametrize("status", [404, 405, 501])
+def test_missing_batch_endpoint_latches_per_text(monkeypatch, status):
+    calls = []
+    routes = {"batchEmbedContents": status, "embedContent": 200}
+    monkeypatch.setattr(embedder.GEMINI_SESSION, "post", fake_post(routes, calls))
+    e = GeminiEmbedder("key")
+
+    out = e.embed_texts(["a", "b"])
+    assert out.tolist() == [[3.0, 4.0], [3.0, 4.0]]
+    assert not e._batch_supported
+
+    calls.clear()
+    e.embed_texts(["c"])
+    assert calls == ["embedContent"]
+
+
+def test_bad_request_does_not_latch(monkeypatch):
+    calls = []
+    routes = {"batchEmbedContents": 400, "embedContent": 200}
+    monkeypatch.setattr(embedder.GEMINI_SESSION, "post", fake_post(routes, calls))
+    e = GeminiEmbedder("key")
+
+    with pytest.raises(RuntimeError):
+        e.embed_texts(["a", "b"])
+    assert e._batch_supported
+    assert calls == ["batchEmbedContents"]
+
+    routes["batchEmbedContents"] = 200
+    assert e.embed_texts(["a"]).tolist() == [[1.0, 2.0]]
+
+
+def test_batch_results_keep_input_order(monkeypatch):
+    def post(url, json=None, **kwargs):
+        values = [{"values": [float(len(r["content"]["parts"][0]["text"]))]} for r in json["requests"]]
+        return FakeResponse(200, {"embeddings": values})
+
+    monkeypatch.setattr(embedder.GEMINI_SESSION, "post", post)
+    texts = ["x" * n for n in range(1, 251)]
+    out = GeminiEmbedder("key").embed_texts(texts)
+    assert out.dtype == np.float32
+    assert out[:, 0].tolist() == [float(n) for n in range(1, 251)]
+
+
+def test_fallback_embeddings_are_per_text_deterministic():
+    e = GeminiEmbedder("key")
+    batch = e._fallback_embeddings(["alpha", "beta", "gamma"])
+    alone = e._fallback_embeddings(["beta"])
+
+    assert batch.shape == (3, e.embedding_dim)
+    assert batch.dtype == np.float32
+    # Same text, same vector, regardless of the rest of the batch
+    np.testing.assert_array_equal(batch[1], alone[0])
+    np.testing.assert_array_equal(batch, e._fallback_embeddings(["alpha", "beta", "gamma"]))
+    assert not np.array_equal(batch[0], batch[2])
+    assert batch.min() >= 0.0 and batch.max() < 1.0
+
+
+def test_model_not_found_uses_fallback(monkeypatch):
+    calls = []
+    routes = {"batchEmbedContents": 404, "embedContent": 404}
+    monkeypatch.setattr(embedder.GEMINI_SESSION, "post", fake_post(routes, calls))
+    e = GeminiEmbedder("key")
+
+    out = e.embed_texts(["a", "b"])
+    np.testing.assert_array_equal(out, e._fallback_embeddings(["a", "b"]))
+    np.testing.assert_array_equal(e.embed_single("b"), out[1])
+
+
+def test_missing_model_does_not_fan_out(monkeypatch):
+    calls = []
+    routes = {"batchEmbedContents": 404, "embedContent": 404}
+    monkeypatch.setattr(embedder.GEMINI_SESSION, "post", fake_post(routes, calls))
+    e = GeminiEmbedder("key")
+
+    texts = [f"chunk {i}" for i in range(250)]
+    out = e.embed_texts(texts)
+    np.testing.assert_array_equal(out, e._fallback_embeddings(texts))
+    # At most one batch call and one probe per batch in flight, never one per text
+    assert calls.count("embedContent") <= embedder.EMBED_MAX_BATCHES_IN_FLIGHT
+    assert len(calls) <= 2 * embedder.EMBED_MAX_BATCHES_IN_FLIGHT
+    assert e._model_missing
+
+    calls.clear()
+    e.embed_texts(["later upload"])
+    assert calls == []
+
+
+def test_embed_single_caches_repeated_text(monkeypatch):
+    calls = []
+    routes = {"batchEmbedContents": 200, "embedContent": 200}
+    monkeypatch.setattr(embedder.GEMINI_SESSION, "post", fake_post(routes, calls))
+    e = GeminiEmbedder("key")
+
+    first = e.embed_single("same query")
+    second = e.embed_single("same query")
+    assert calls == ["batchEmbedContents"]
+    np.testing.assert_array_equal(first, second)
+    assert not first.flags.writeable
+
+    e.embed_single("another query")
+    assert len(calls) == 2
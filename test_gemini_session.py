@@ -0,0 +1,66 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import embedder
+
+
+@pytest.fixture
+def server():
+    """Local HTTP server whose responses are scripted per request."""
+    script = []
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            hits.append(time.monotonic())
+            status, delay = script[min(len(hits), len(script)) - 1]
+            time.sleep(delay)
+            try:
+                self.send_response(status)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+            except OSError:
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}/", script, hits
+    httpd.shutdown()
+
+
+@pytest.fixture
+def session():
+    # The Gemini adapter (and its retry policy) mounted for plain HTTP
+    s = requests.Session()
+    s.mount("http://", embedder.GEMINI_SESSION.get_adapter("https://generativelanguage.googleapis.com"))
+    return s
+
+
+def test_read_timeout_is_not_retried(server, session):
+    url, script, hits = server
+    script.append((200, 1.0))
+
+    start = time.monotonic()
+    with pytest.raises(requests.ReadTimeout):
+        session.post(url, json={}, timeout=0.2)
+    assert len(hits) == 1
+    assert time.monotonic() - start < 1.0
+
+
+def test_transient_status_is_retried(server, session):
+    url, script, hits = server
+    script.extend([(503, 0), (429, 0), (200, 0)])
+
+    resp = session.post(url, json={}, timeout=5)
+    assert resp.status_code == 200
+    assert len(hits) == 3